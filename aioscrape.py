@@ -0,0 +1,110 @@
+import sys
+import logging
+
+import trollius as asyncio
+from trollius import From
+from concurrent.futures import ThreadPoolExecutor
+
+import scraper
+
+logger = logging.getLogger('scraper')
+
+# Coroutine version of SiteScraper.scrape(), which supplies everything
+# around the loop. Page and feed downloads run in the loop's executor;
+# _get_items/_process_item and all DB work stay on the loop thread, so the
+# session is never shared between threads.
+@asyncio.coroutine
+def scrape(s, loop):
+    with s._scraping():
+        if s.RSS:
+            urls = s.URL if type(s.URL) == list else [ s.URL ]
+
+            # Feeds are fetched in turn, so a duplicate or the date limit
+            # skips the remaining ones
+            for url in urls:
+                entries = yield From(
+                    loop.run_in_executor(None, s._get_feed, url))
+
+                new_items, done = s._save_feed(entries)
+
+                if done:
+                    break
+        else:
+            pages = asyncio.Queue(loop=loop)
+
+            # Without prefetching, the next page is fetched once the
+            # current one is saved
+            slots = asyncio.Semaphore(max(s.PREFETCH_DEPTH, 1), loop=loop)
+
+            fetcher = asyncio.ensure_future(
+                fetch_pages(s, loop, pages, slots), loop=loop)
+
+            # Cancelling the fetcher drops any prefetches in flight
+            try:
+                while 1:
+                    soup, exc_info = yield From(pages.get())
+
+                    if exc_info:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+
+                    if soup is None:
+                        break
+
+                    if s.PREFETCH_DEPTH > 0:
+                        slots.release()
+
+                    new_items, done = s._save_page(soup)
+
+                    if done:
+                        break
+
+                    if s.PREFETCH_DEPTH == 0:
+                        slots.release()
+            finally:
+                fetcher.cancel()
+
+# Download and parse listing pages in order, handing them to scrape()
+@asyncio.coroutine
+def fetch_pages(s, loop, pages, slots):
+    page = 1
+    link = None
+
+    try:
+        while 1:
+            yield From(slots.acquire())
+
+            logger.debug('%d %s' % (page, link or s.URL))
+
+            soup = yield From(loop.run_in_executor(None, s.get, link))
+            link = s._page_link(soup)
+
+            pages.put_nowait((soup, None))
+
+            if link is None:
+                break
+
+            page += 1
+
+    except asyncio.CancelledError:
+        raise
+
+    except Exception:
+        pages.put_nowait((None, sys.exc_info()))
+
+    pages.put_nowait((None, None))
+
+# Run the named scrapers on one event loop, with at most max_fetches pages
+# or feeds downloading at once. Returns the scrapers' stage timers.
+def run(names, max_fetches):
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_fetches))
+
+    scrapers = [ getattr(scraper, s)() for s in names ]
+
+    try:
+        loop.run_until_complete(asyncio.wait(
+            [ scrape(s, loop) for s in scrapers ], loop=loop))
+    finally:
+        loop.close()
+
+    return [ s.timer for s in scrapers ]
@@ -0,0 +1,136 @@
+# Local stand-in for the Drupal services endpoints DrupalPoster uses: the
+# home page, user/login and node create, with configurable latency, server
+# errors and 429 throttling. GET /stats returns request counts.
+#
+#   python bench/drupal_server.py --port 8880 --latency 50 --error-rate 0.01
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+SESSION_NAME = 'SESSbench'
+SESSION_ID = 'bench-session'
+TOKEN = 'bench-token'
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out in separate writes, don't let Nagle hold the
+    # body back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def __send(self, code, obj, headers=None):
+        body = json.dumps(obj)
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            with self.server.lock:
+                stats = dict(self.server.stats)
+
+            self.__send(200, stats)
+        else:
+            self.server.count('home')
+            self.__send(200, {})
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        data = json.loads(self.rfile.read(length) or '{}')
+        path = self.path.rstrip('/')
+        options = self.server.options
+
+        if path.endswith('/user/login'):
+            self.server.count('login')
+            self.__send(200, {
+                'session_name': SESSION_NAME,
+                'sessid': SESSION_ID,
+                'token': TOKEN
+            })
+            return
+
+        if not path.endswith('/node'):
+            self.server.count('not_found')
+            self.__send(404, {})
+            return
+
+        latency = max(0.0, random.gauss(options.latency, options.jitter))
+        time.sleep(latency / 1000.0)
+
+        cookie = '%s=%s' % (SESSION_NAME, SESSION_ID)
+
+        if cookie not in (self.headers.get('cookie') or '') or \
+           self.headers.get('x-csrf-token') != TOKEN:
+            self.server.count('forbidden')
+            self.__send(403, {})
+
+        elif random.random() < options.throttle_rate:
+            self.server.count('throttled')
+            self.__send(429, {}, { 'Retry-After': str(options.retry_after) })
+
+        elif random.random() < options.error_rate:
+            self.server.count('errors')
+            self.__send(500, {})
+
+        else:
+            nid = self.server.count('created')
+            self.__send(200, { 'nid': nid, 'title': data.get('title') })
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, options):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+
+        self.options = options
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+            return self.stats[name]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8880)
+    parser.add_argument('--latency', type=float, default=50.0,
+                        help='mean node create latency (ms)')
+    parser.add_argument('--jitter', type=float, default=10.0,
+                        help='latency standard deviation (ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    options = parse_args()
+    server = Server((options.host, options.port), options)
+
+    sys.stderr.write('Drupal stand-in on http://%s:%d\n' %
+                     (options.host, options.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
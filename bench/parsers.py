@@ -0,0 +1,115 @@
+# Time BeautifulSoup parsing of every HTML source page with each parser
+# backend, of the whole page and of the scraper's PARSE_ONLY regions, and
+# check each one still finds the scraper's items and next link.
+#
+#   python bench/parsers.py                  # fetch pages live
+#   python bench/parsers.py --save pages/    # ...and keep them
+#   python bench/parsers.py --pages pages/   # offline, from saved pages
+import os
+import sys
+import time
+import json
+import inspect
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+import scraper
+
+PARSERS = [ 'lxml', 'html.parser', 'html5lib' ]
+
+def html_scrapers(only=None):
+    rv = []
+
+    for name, cls in sorted(vars(scraper).items()):
+        if inspect.isclass(cls) and issubclass(cls, scraper.SiteScraper) \
+           and cls is not scraper.SiteScraper and not cls.RSS:
+            if only is None or name in only:
+                rv.append(cls)
+
+    return rv
+
+def load_page(cls, pages_dir, save_dir):
+    if pages_dir:
+        with open(os.path.join(pages_dir, '%s.html' % cls.__name__)) as f:
+            return f.read().decode('utf-8')
+
+    markup = cls().fetch(cls.URL).text
+
+    if save_dir:
+        with open(os.path.join(save_dir, '%s.html' % cls.__name__), 'w') as f:
+            f.write(markup.encode('utf-8'))
+
+    return markup
+
+def bench(cls, markup, parser, partial, repeat):
+    s = cls()
+    strainer = scraper.region_strainer(cls.PARSE_ONLY) if partial else None
+    times = []
+
+    for i in range(repeat):
+        start = time.time()
+        soup = BeautifulSoup(markup, parser, parse_only=strainer)
+        times.append(time.time() - start)
+
+    return {
+        'scraper': cls.__name__,
+        'parser': parser,
+        'partial': partial,
+        'default': parser == cls.PARSER and partial == bool(cls.PARSE_ONLY),
+        'nodes': len(soup.find_all(True)),
+        'bytes': len(markup.encode('utf-8')),
+        'parse_ms': min(times) * 1000,
+        'mean_ms': sum(times) / len(times) * 1000,
+        'items': len(s._get_items(soup)),
+        'next_link': s._page_link(soup) is not None
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages')
+    parser.add_argument('--save')
+    parser.add_argument('--only')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+
+    for cls in html_scrapers(args.only.split(',') if args.only else None):
+        try:
+            markup = load_page(cls, args.pages, args.save)
+        except Exception, e:
+            sys.stderr.write('%s: %s\n' % (cls.__name__, e))
+            continue
+
+        for p in PARSERS:
+
+            # html5lib always builds the whole tree
+            modes = [ False, True ] \
+                    if cls.PARSE_ONLY and p != 'html5lib' else [ False ]
+
+            for partial in modes:
+                try:
+                    results.append(bench(cls, markup, p, partial, args.repeat))
+                except FeatureNotFound:
+                    sys.stderr.write('%s: parser not installed\n' % p)
+                    break
+
+    if args.json:
+        print json.dumps(results, sort_keys=True, indent=4)
+        sys.exit()
+
+    print '%-26s %-14s %-7s %8s %9s %9s %7s %6s %5s' % \
+          ('Scraper', 'Parser', 'Tree', 'KiB', 'Min (ms)', 'Mean (ms)',
+           'Nodes', 'Items', 'Next')
+
+    for r in results:
+        print '%-26s %-14s %-7s %8.1f %9.1f %9.1f %7d %6d %5s' % \
+              (r['scraper'], r['parser'] + (' *' if r['default'] else ''),
+               'partial' if r['partial'] else 'full', r['bytes'] / 1024.0,
+               r['parse_ms'], r['mean_ms'], r['nodes'], r['items'],
+               'yes' if r['next_link'] else 'no')
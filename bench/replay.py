@@ -0,0 +1,301 @@
+# Replay recorded listing pages and feeds through each scraper's full
+# scrape() into a scratch database, with no network, and report items/sec,
+# per-stage times and peak memory. Every scraper runs in its own process so
+# peak RSS isn't inflated by the ones before it. bench/fixtures holds
+# hand-built pages and feeds for every scraper, used by default.
+#
+#   python bench/replay.py --out before.json
+#   python bench/replay.py --compare before.json
+#   python bench/replay.py --record --fixtures live/   # fetch live, save
+import os
+import sys
+import json
+import shutil
+import inspect
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import requests
+
+import scraper
+import timing
+from model import *
+
+INDEX = 'index.json'
+
+def all_scrapers(only=None):
+    rv = []
+
+    for name, cls in sorted(vars(scraper).items()):
+        if inspect.isclass(cls) and issubclass(cls, scraper.SiteScraper) \
+           and cls is not scraper.SiteScraper:
+            if only is None or name in only:
+                rv.append(cls)
+
+    return rv
+
+# Peak RSS so far in KiB (ru_maxrss is KiB on Linux, bytes on OS X)
+def peak_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss / 1024 if sys.platform == 'darwin' else rss
+
+# Stage timer that also charges growth in peak RSS to the stage that was
+# running when it happened
+class MemoryTimer(timing.StageTimer):
+    def __init__(self, name):
+        timing.StageTimer.__init__(self, name)
+
+        self.peak_growth = dict((stage, 0) for stage in self.STAGES)
+        self.__last_peak = peak_kib()
+
+    def add(self, stage, seconds, page=None):
+        timing.StageTimer.add(self, stage, seconds, page)
+
+        peak = peak_kib()
+        self.peak_growth[stage] += peak - self.__last_peak
+        self.__last_peak = peak
+
+# Subclass of a scraper whose downloads come from (or, when recording, are
+# saved to) a fixture directory, stopping after max_pages listing pages
+def fixture_scraper(cls, fixture_dir, record=False, max_pages=None):
+    index_path = os.path.join(fixture_dir, INDEX)
+    index = {}
+
+    if not record:
+        with open(index_path) as f:
+            index = dict((entry['url'], entry) for entry in json.load(f))
+
+    def fetch(self, url):
+        if record:
+            r = cls.fetch(self, url)
+            name = '%03d.%s' % (len(index), 'xml' if cls.RSS else 'html')
+
+            with open(os.path.join(fixture_dir, name), 'wb') as f:
+                f.write(r.content)
+
+            index[url] = {
+                'url': url,
+                'file': name,
+                'content_type': r.headers.get('content-type'),
+                'encoding': r.encoding
+            }
+
+            with open(index_path, 'w') as f:
+                json.dump(sorted(index.values(), key=lambda e: e['file']), f,
+                          indent=4)
+
+            return r
+
+        if url not in index:
+            raise Exception('No fixture for %s' % url)
+
+        entry = index[url]
+        r = requests.models.Response()
+        r.status_code = requests.codes.ok
+        r.url = url
+        r.encoding = entry['encoding']
+        r.headers['content-type'] = entry['content_type'] or ''
+
+        with open(os.path.join(fixture_dir, entry['file']), 'rb') as f:
+            r._content = f.read()
+
+        return r
+
+    def _page_link(self, soup):
+        self.pages_seen = getattr(self, 'pages_seen', 0) + 1
+
+        if max_pages and self.pages_seen >= max_pages:
+            return None
+
+        link = cls._page_link(self, soup)
+
+        # Recorded runs end at the last page that was saved
+        if not record and link not in index:
+            return None
+
+        return link
+
+    class Fixture(cls):
+        HTTP_CACHE = None
+        RATE_LIMIT = None
+
+    Fixture.fetch = fetch
+    Fixture._page_link = _page_link
+
+    # Same name, so scraper_type and the timer read as the real scraper
+    Fixture.__name__ = cls.__name__
+
+    return Fixture
+
+# Scrape one scraper into a fresh database, in this process
+def run_one(cls, fixture_dir, record, max_pages, profile):
+    tmp = tempfile.mkdtemp()
+
+    try:
+        change_db(os.path.join(tmp, 'bench.sqlite'), profile)
+        setup_elixir()
+
+        s = fixture_scraper(cls, fixture_dir, record, max_pages)()
+        s.timer = MemoryTimer(cls.__name__)
+        s.scrape()
+
+        items = cls.CLS.query.count()
+        elapsed = s.timer.elapsed()
+
+        return {
+            'scraper': cls.__name__,
+            'items': items,
+            'pages': getattr(s, 'pages_seen', 0) or len(s.timer.pages),
+            'elapsed': elapsed,
+            'items_per_sec': items / elapsed if elapsed else 0.0,
+            'stages': s.timer.totals,
+            'stage_peak_kib': s.timer.peak_growth,
+            'peak_kib': peak_kib()
+        }
+    finally:
+        session.remove()
+        shutil.rmtree(tmp)
+
+# Run a scraper in a child process, repeat times, keeping the fastest run
+# and the highest peak
+def run_child(cls, args):
+    best = None
+    peak = 0
+
+    for i in range(args.repeat):
+        cmd = [ sys.executable, os.path.abspath(__file__),
+                '--child', cls.__name__, '--fixtures', args.fixtures,
+                '--sqlite-profile', args.sqlite_profile ]
+
+        if args.max_pages:
+            cmd += [ '--max-pages', str(args.max_pages) ]
+
+        result = json.loads(subprocess.check_output(cmd))
+        peak = max(peak, result['peak_kib'])
+
+        if best is None or result['elapsed'] < best['elapsed']:
+            best = result
+
+    best['peak_kib'] = peak
+
+    return best
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            [ 'git', 'rev-parse', '--short', 'HEAD' ],
+            stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        return None
+
+def print_results(results):
+    print '%-26s %6s %6s %9s %9s %9s %10s %10s %9s' % \
+          ('Scraper', 'Items', 'Pages', 'Items/s', 'Parse (s)',
+           'Extr. (s)', 'Dedupe (s)', 'Commit (s)', 'Peak KiB')
+
+    for r in results:
+        print '%-26s %6d %6d %9.1f %9.3f %9.3f %10.3f %10.3f %9d' % \
+              (r['scraper'], r['items'], r['pages'], r['items_per_sec'],
+               r['stages']['parse'], r['stages']['extract'] +
+               r['stages']['date'], r['stages']['dedupe'],
+               r['stages']['commit'], r['peak_kib'])
+
+# Items/sec and parse time against an earlier results file
+def print_comparison(results, baseline):
+    before = dict((r['scraper'], r) for r in baseline['results'])
+
+    print
+    print 'Compared with %s' % (baseline.get('revision') or 'baseline')
+    print '%-26s %10s %10s %10s' % ('Scraper', 'Items/s', 'Parse', 'Peak')
+
+    for r in results:
+        if r['scraper'] not in before:
+            continue
+
+        b = before[r['scraper']]
+
+        def change(new, old):
+            return '%+9.1f%%' % ((new - old) * 100.0 / old) if old else '-'
+
+        print '%-26s %10s %10s %10s' % \
+              (r['scraper'], change(r['items_per_sec'], b['items_per_sec']),
+               change(r['stages']['parse'], b['stages']['parse']),
+               change(r['peak_kib'], b['peak_kib']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures',
+                        default=os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), 'fixtures'))
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--only')
+    parser.add_argument('--max-pages', type=int)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sqlite-profile', default='default',
+                        choices=sorted(SQLITE_PROFILES.keys()))
+    parser.add_argument('--out')
+    parser.add_argument('--compare')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.getLogger('scraper').setLevel(logging.ERROR)
+
+    if args.child:
+        cls = getattr(scraper, args.child)
+
+        print json.dumps(run_one(cls, os.path.join(args.fixtures, cls.__name__),
+                                 False, args.max_pages, args.sqlite_profile))
+        sys.exit()
+
+    results = []
+
+    for cls in all_scrapers(args.only.split(',') if args.only else None):
+        fixture_dir = os.path.join(args.fixtures, cls.__name__)
+
+        if args.record:
+            if not os.path.isdir(fixture_dir):
+                os.makedirs(fixture_dir)
+
+            run_one(cls, fixture_dir, True, args.max_pages,
+                    args.sqlite_profile)
+            continue
+
+        if not os.path.exists(os.path.join(fixture_dir, INDEX)):
+            sys.stderr.write('%s: no fixtures\n' % cls.__name__)
+            continue
+
+        try:
+            results.append(run_child(cls, args))
+        except Exception, e:
+            sys.stderr.write('%s: %s\n' % (cls.__name__, e))
+
+    if args.record:
+        sys.exit()
+
+    report = {
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'sqlite_profile': args.sqlite_profile,
+        'results': results
+    }
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, sort_keys=True, indent=4)
+
+    if args.json:
+        print json.dumps(report, sort_keys=True, indent=4)
+    else:
+        print_results(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
@@ -0,0 +1,212 @@
+# Post a batch of articles through feeder.do_post()/DrupalPoster to the local
+# Drupal stand-in (bench/drupal_server.py) at several worker counts, and
+# report posts/sec and per-post latency percentiles, retries included.
+#
+#   python bench/upload.py --items 500 --workers 1,2,4,8
+#   python bench/upload.py --latency 100 --throttle-rate 0.05 --json
+#   python bench/upload.py --url http://127.0.0.1:8880   # server already up
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import datetime
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import requests
+
+import feeder
+import uploader
+from model import *
+
+# DrupalPoster that records how long each node create took
+class TimedPoster(uploader.DrupalPoster):
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        self.__lock = threading.Lock()
+
+        uploader.DrupalPoster.__init__(self, *args, **kwargs)
+
+    def send(self, data):
+        start = time.time()
+
+        try:
+            return uploader.DrupalPoster.send(self, data)
+        finally:
+            with self.__lock:
+                self.latencies.append(time.time() - start)
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+# Start the stand-in in its own process, so it doesn't share the GIL with
+# the poster being measured
+def start_server(args):
+    port = free_port()
+
+    server = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, 'drupal_server.py'),
+        '--port', str(port),
+        '--latency', str(args.latency),
+        '--jitter', str(args.jitter),
+        '--error-rate', str(args.error_rate),
+        '--throttle-rate', str(args.throttle_rate),
+        '--retry-after', str(args.retry_after)
+    ], stderr=open(os.devnull, 'w'))
+
+    url = 'http://127.0.0.1:%d' % port
+
+    for i in range(50):
+        try:
+            requests.get(url + '/stats', timeout=1)
+            return server, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise Exception('Drupal stand-in did not start')
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def add_articles(count):
+    now = datetime.datetime.now()
+
+    for i in range(count):
+        Article(title=u'Benchmark article %d' % i,
+                url=u'http://example.com/bench/%d' % i,
+                body=u'Body of benchmark article %d. ' % i * 20,
+                date=now, scraper_type=u'Benchmark')
+
+    session.commit()
+
+def run(workers, args):
+    Article.set_all_pending()
+
+    poster = TimedPoster(pool_size=workers,
+                         retry=uploader.RetryPolicy(max_delay=args.max_delay,
+                                                    budget=None))
+
+    start = time.time()
+    feeder.do_post(poster, Article, workers=workers)
+    elapsed = time.time() - start
+
+    posted = Article.query.filter(Article.time_posted != None).count()
+    latencies = poster.latencies
+
+    return {
+        'workers': workers,
+        'posts': posted,
+        'failed': args.items - posted,
+        'elapsed': elapsed,
+        'posts_per_sec': posted / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--url')
+    parser.add_argument('--latency', type=float, default=50.0)
+    parser.add_argument('--jitter', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--max-delay', type=float, default=2.0)
+    parser.add_argument('--out')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    feeder.setup_loggers()
+
+    if not args.debug:
+        logging.getLogger('feeder').setLevel(logging.ERROR)
+        logging.getLogger('uploader').setLevel(logging.ERROR)
+
+    server = None
+    url = args.url
+
+    if url is None:
+        server, url = start_server(args)
+
+    os.environ.update({
+        'DRUPAL_BASE': url,
+        'DRUPAL_API_PATH': 'api',
+        'DRUPAL_USER': 'bench',
+        'DRUPAL_PASS': 'bench',
+        'DRUPAL_NODE_PATH': 'node',
+        'DRUPAL_LOGIN_PATH': 'user/login'
+    })
+
+    tmp = tempfile.mkdtemp()
+    results = []
+
+    try:
+        change_db(os.path.join(tmp, 'bench.sqlite'))
+        setup_elixir()
+        add_articles(args.items)
+
+        for workers in [ int(w) for w in args.workers.split(',') ]:
+            results.append(run(workers, args))
+
+        stats = requests.get(url + '/stats').json()
+    finally:
+        session.remove()
+        shutil.rmtree(tmp)
+
+        if server is not None:
+            server.kill()
+
+    report = {
+        'items': args.items,
+        'latency_ms': args.latency,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+        'server': stats,
+        'results': results
+    }
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, sort_keys=True, indent=4)
+
+    if args.json:
+        print json.dumps(report, sort_keys=True, indent=4)
+        sys.exit()
+
+    print '%7s %6s %6s %9s %9s %9s %9s %9s' % \
+          ('Workers', 'Posts', 'Failed', 'Posts/s', 'p50 (ms)', 'p95 (ms)',
+           'p99 (ms)', 'Max (ms)')
+
+    for r in results:
+        print '%7d %6d %6d %9.1f %9.1f %9.1f %9.1f %9.1f' % \
+              (r['workers'], r['posts'], r['failed'], r['posts_per_sec'],
+               r['p50_ms'], r['p95_ms'], r['p99_ms'], r['max_ms'])
+
+    print
+    print 'Server: %s' % ', '.join('%s %d' % (k, v)
+                                   for k, v in sorted(stats.items()))
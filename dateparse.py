@@ -0,0 +1,73 @@
+import datetime
+import threading
+from collections import OrderedDict
+
+# Imported up front, strptime's lazy import isn't thread safe on Python 2
+import _strptime
+import dateutil.parser
+
+# Date string parser with a bounded LRU cache. Explicit strptime formats are
+# tried first and dateutil only when none of them fit; the counters show
+# which sources keep falling back to the slow path.
+class DateParser:
+    def __init__(self, formats=None, size=1024):
+        self.formats = list(formats or [])
+        self.hits = 0
+        self.misses = 0
+        self.fast = 0
+        self.fallbacks = 0
+
+        self.__size = size
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def parse(self, text):
+        with self.__lock:
+            if text in self.__cache:
+                self.hits += 1
+
+                # Move to the most recently used end
+                value = self.__cache.pop(text)
+                self.__cache[text] = value
+
+                return value
+
+            self.misses += 1
+
+        value = self.__parse(text)
+
+        with self.__lock:
+            self.__cache[text] = value
+
+            if len(self.__cache) > self.__size:
+                self.__cache.popitem(last=False)
+
+        return value
+
+    def __parse(self, text):
+        stripped = text.strip()
+
+        for fmt in self.formats:
+            try:
+                value = datetime.datetime.strptime(stripped, fmt)
+                self.fast += 1
+
+                return value
+
+            except ValueError:
+                pass
+
+        self.fallbacks += 1
+
+        return dateutil.parser.parse(text)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'strptime': self.fast,
+            'fallbacks': self.fallbacks
+        }
@@ -0,0 +1,68 @@
+import sys
+import math
+import struct
+import hashlib
+
+# Exact set of seen URLs
+class UrlSet:
+    exact = True
+
+    def __init__(self):
+        self.__urls = set()
+
+    def add(self, url):
+        self.__urls.add(url)
+
+    def __contains__(self, url):
+        return url in self.__urls
+
+    def __len__(self):
+        return len(self.__urls)
+
+    # Approximate size in bytes, including the URL strings
+    def memory(self):
+        return sys.getsizeof(self.__urls) + \
+               sum(sys.getsizeof(url) for url in self.__urls)
+
+# Bloom filter of seen URLs, for long histories. Lookups can return false
+# positives (never false negatives), so hits need confirming elsewhere.
+class BloomFilter:
+    exact = False
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+
+        self.__bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.__hashes = max(1, int(round(
+            float(self.__bits) / capacity * math.log(2))))
+        self.__array = bytearray((self.__bits + 7) // 8)
+        self.__count = 0
+
+    # Bit positions for a URL, by double hashing one MD5 digest
+    def __positions(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        a, b = struct.unpack('<QQ', hashlib.md5(url).digest())
+
+        return [ (a + i * b) % self.__bits for i in range(self.__hashes) ]
+
+    def add(self, url):
+        for pos in self.__positions(url):
+            self.__array[pos >> 3] |= 1 << (pos & 7)
+
+        self.__count += 1
+
+    def __contains__(self, url):
+        for pos in self.__positions(url):
+            if not self.__array[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def __len__(self):
+        return self.__count
+
+    def memory(self):
+        return sys.getsizeof(self.__array)
@@ -2,10 +2,21 @@ import sys
 import argparse
 import logging
 import os
+import time
+import atexit
 import json
+import datetime
+import itertools
+import Queue
+from multiprocessing.pool import ThreadPool
 
 import scraper
 import uploader
+import httpcache
+import ratelimit
+import timing
+import metrics
+import profiling
 from model import *
 
 global MODULE_LOG_LEVEL
@@ -27,26 +38,209 @@ def setup_loggers():
 
     logging.getLogger('scraper').setLevel(MODULE_LOG_LEVEL)
     logging.getLogger('uploader').setLevel(MODULE_LOG_LEVEL)
+    logging.getLogger('profiling').setLevel(MODULE_LOG_LEVEL)
 
-def do_post(poster, things, limit=None):
-    progress = 1
-    num_things = len(things)
+def do_post(poster, cls, limit=None, workers=1):
+    progress = 0
+    num_things = cls.pending_count()
 
-    logger.info('Posting %s (%d)...' % 
-                 (things[0].__class__.__name__, num_things))
+    if num_things == 0:
+        logger.warning('No pending items for %s' % cls.__name__)
+        return
 
-    for thing in things:
-        logger.debug('%d/%d...' % (progress, num_things))
-        
-        d.post(thing)
-        progress += 1        
+    logger.info('Posting %s (%d)...' % (cls.__name__, num_things))
+
+    things = cls.pending_post()
+
+    if limit and num_things > limit:
+        things = itertools.islice(things, limit)
+        num_things = limit
+
+    if workers > 1:
+        posts = post_concurrently(poster, things, workers)
+    else:
+        posts = ((thing, poster.post(thing)) for thing in things)
 
-        if limit and progress >= limit:
-            logger.info('Post limit reached (%d)' % limit)
-            return
+    for thing, posted in posts:
+        progress += 1
+
+        metrics.inc('posts_total', type=cls.__name__,
+                    result='ok' if posted else 'failed')
+        logger.debug('%d/%d...' % (progress, num_things))
 
         if progress % PROGRESS_INTERVAL == 0:
-            logger.debug('Progress: %d/%d' % (progress, len(things)))
+            logger.debug('Progress: %d/%d' % (progress, num_things))
+
+    if limit and progress >= limit:
+        logger.info('Post limit reached (%d)' % limit)
+
+# Posts several nodes at once. Workers only do HTTP; payloads are built and
+# time_posted is recorded on this thread, which owns the ORM objects.
+def post_concurrently(poster, things, workers):
+    results = Queue.Queue()
+    pool = ThreadPool(workers)
+    things = iter(things)
+    in_flight = 0
+    error = None
+
+    def send(thing, data):
+        try:
+            return thing, poster.send(data), None
+        except Exception:
+            return thing, None, sys.exc_info()
+
+    try:
+        while 1:
+
+            # Keep a couple of nodes queued per worker, stop feeding on error
+            while error is None and in_flight < workers * 2:
+                thing = next(things, None)
+
+                if thing is None:
+                    break
+
+                pool.apply_async(send, (thing, poster.node(thing)),
+                                 callback=results.put)
+                in_flight += 1
+
+            if in_flight == 0:
+                break
+
+            thing, time_posted, exc_info = results.get()
+            in_flight -= 1
+
+            if exc_info:
+                error = error or exc_info
+                continue
+
+            if time_posted:
+                thing.time_posted = time_posted
+                session.commit()
+
+            yield thing, time_posted is not None
+
+    finally:
+        pool.close()
+        pool.join()
+
+    # Re-raise worker errors (e.g. max retries) once in-flight posts are saved
+    if error:
+        raise error[0], error[1], error[2]
+
+# Returns the stage timers of the scrapers that ran
+def run_scrapers(names, workers=1, use_async=False):
+    if use_async:
+
+        # trollius (asyncio for Python 2) is only needed for this mode
+        try:
+            import aioscrape
+        except ImportError, e:
+            logger.error(e)
+            logger.error('--scrape-async needs trollius '
+                         '(pip install trollius), exiting')
+            sys.exit(1)
+
+        # Without an explicit worker count, allow as many fetches as one
+        # scraper's connection pool holds rather than one per site
+        max_fetches = workers if workers > 1 \
+                      else scraper.SiteScraper.POOL_MAXSIZE
+
+        logger.info('Scraping on event loop (%d concurrent fetches)' %
+                    max_fetches)
+
+        return aioscrape.run(names, max_fetches)
+
+    if workers <= 1:
+        timers = []
+
+        for name in names:
+            s = getattr(scraper, name)()
+            s.scrape()
+            timers.append(s.timer)
+
+        return timers
+
+    logger.info('Scraping with %d workers' % workers)
+
+    # Scrapers fetch and parse in parallel, all DB work goes via the writer
+    writer = SessionWriter()
+    writer.start()
+
+    pool = ThreadPool(workers)
+
+    def run(name):
+        s = getattr(scraper, name)(writer)
+        s.scrape()
+
+        return s.timer
+
+    try:
+        return pool.map(run, names)
+    finally:
+        pool.close()
+        pool.join()
+        writer.stop()
+
+# Pending item report, grouped by scraper type, then class. JSON maps to
+# plain counts, or to count/oldest/newest objects with dates.
+def format_pending(fmt='json', with_dates=False):
+    rows = []
+
+    for cls in [ Article, Event, Publication ]:
+        for row in cls.pending_summary(with_dates):
+            rows.append((row[0], cls.__name__) + tuple(row[1:]))
+
+    rows.sort()
+
+    if fmt == 'table':
+        header = ('scraper', 'type', 'pending')
+
+        if with_dates:
+            header += ('oldest', 'newest')
+
+        lines = [ header ] + [
+            tuple('' if v is None else unicode(v) for v in row)
+            for row in rows ]
+
+        widths = [ max(len(line[i]) for line in lines)
+                   for i in range(len(header)) ]
+
+        return '\n'.join('  '.join(v.ljust(w) for v, w in zip(line, widths))
+                          .rstrip() for line in lines)
+
+    pending_map = {}
+
+    for row in rows:
+        if with_dates:
+            value = {
+                'count': row[2],
+                'oldest': row[3].isoformat() if row[3] else None,
+                'newest': row[4].isoformat() if row[4] else None
+            }
+        else:
+            value = row[2]
+
+        pending_map.setdefault(row[0], {})[row[1]] = value
+
+    return json.dumps(pending_map, sort_keys=True, indent=4)
+
+# Record the run's duration and write the Prometheus textfile, if any.
+# Registered with atexit so runs ending in sys.exit() are reported too.
+def finish_metrics(path, started):
+    now = time.time()
+
+    metrics.gauge('run_duration_seconds', now - started)
+    metrics.gauge('last_run_timestamp_seconds', now)
+
+    if path:
+        metrics.REGISTRY.write_textfile(path)
+
+# argparse type for YYYY-MM-DD options
+def parse_day(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected YYYY-MM-DD, got %s' % text)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -54,79 +248,142 @@ if __name__ == '__main__':
     parser.add_argument('--no-scrape', action='store_true')
     parser.add_argument('--no-post', action='store_true')
     parser.add_argument('--post-limit', type=int)
+    parser.add_argument('--post-workers', type=int, default=1)
+    parser.add_argument('--post-max-tries', type=int, default=10)
+    parser.add_argument('--post-max-delay', type=float, default=60.0)
+    parser.add_argument('--post-retry-budget', type=int, default=100)
+    parser.add_argument('--post-rate', type=float)
+    parser.add_argument('--post-burst', type=int, default=1)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--db', default='db/scraper.sqlite')
+    parser.add_argument('--sqlite-profile', default='default',
+                        choices=sorted(SQLITE_PROFILES.keys()))
     parser.add_argument('--kill-db', action='store_true')
     parser.add_argument('--events-only', action='store_true')
     parser.add_argument('--pubs-only', action='store_true')
     parser.add_argument('--show-pending', action='store_true')
-    parser.add_argument('--set-all-pending', action='store_true')
+    parser.add_argument('--format', default='json',
+                        choices=[ 'json', 'table' ])
+    parser.add_argument('--with-dates', action='store_true')
+    parser.add_argument('--set-all-pending', '--set-pending',
+                        action='store_true')
+    parser.add_argument('--since', type=parse_day)
+    parser.add_argument('--until', type=parse_day)
     parser.add_argument('--only')
+    parser.add_argument('--scrape-workers', type=int, default=1)
+    parser.add_argument('--scrape-async', action='store_true')
+    parser.add_argument('--prefetch', type=int, default=0)
+    parser.add_argument('--no-http-cache', action='store_true')
+    parser.add_argument('--bulk-insert', action='store_true')
+    parser.add_argument('--http-pool-size', type=int)
+    parser.add_argument('--http-timeout', type=float)
+    parser.add_argument('--user-agent')
+    parser.add_argument('--scrape-rate', type=float)
+    parser.add_argument('--scrape-burst', type=int, default=1)
+    parser.add_argument('--timing-report')
+    parser.add_argument('--metrics-file')
+    parser.add_argument('--statsd')
+    parser.add_argument('--profile', choices=[ 'cprofile', 'sampling' ])
+    parser.add_argument('--profile-out', default='profiles')
+    parser.add_argument('--profile-top', type=int, default=25)
     args = parser.parse_args()
+    started = time.time()
 
     if args.debug:
         MODULE_LOG_LEVEL = logging.DEBUG
 
     setup_loggers()
 
+    # HTTP cache lives next to the database it was scraped into
+    http_cache_path = '%s.http-cache' % args.db
+
     if args.kill_db:
         try:
             os.unlink(args.db)
         except:
             logger.warning('Database %s does not exist' % args.db)
 
+        # Leftover WAL files from the 'fast' SQLite profile
+        for suffix in [ '-wal', '-shm' ]:
+            if os.path.exists(args.db + suffix):
+                os.unlink(args.db + suffix)
+
+        # A stale cache would skip unchanged sources after the DB is reset
+        if os.path.exists(http_cache_path):
+            os.unlink(http_cache_path)
+
     logger.info('Using DB %s' % args.db)
 
-    change_db(args.db)
+    change_db(args.db, args.sqlite_profile)
     setup_elixir()
 
     if args.set_all_pending:
-        logger.info('Set all things pending')
+        scraper_types = args.only.split(',') if args.only else None
+
+        logger.info('Set things pending (scrapers: %s, since: %s, until: %s)' %
+                    (args.only or 'all', args.since or 'any date',
+                     args.until or 'any date'))
 
         for cls in [ Article, Event, Publication ]:
-            cls.set_all_pending()
+            count = cls.set_all_pending(scraper_types, args.since, args.until)
+            logger.info('%s: %d set pending' % (cls.__name__, count))
 
         sys.exit()
 
     if args.show_pending:
         logger.info('Showing pending items')
 
-        pending_map = {}
+        print format_pending(args.format, args.with_dates)
 
-        for cls in [ Article, Event, Publication ]:
-            items = cls.pending_post()
+        sys.exit()
 
-            for item in items:
+    if args.statsd:
+        host, _, port = args.statsd.partition(':')
+        metrics.REGISTRY.emitter = metrics.StatsdEmitter(host, port or 8125)
 
-                # Debug text
-                txt = '%s %s (%s)' % (item.date, item.title, item.url)
-                logger.debug(txt)
+    atexit.register(finish_metrics, args.metrics_file, started)
 
-                # Group pending items by scraper type, then class
-                if item.scraper_type not in pending_map:
-                    pending_map[item.scraper_type] = {}
+    profiler = profiling.PhaseProfiler(args.profile, args.profile_out,
+                                       args.profile_top)
 
-                if cls.__name__ not in pending_map[item.scraper_type]:
-                    pending_map[item.scraper_type][cls.__name__] = 0
+    if not args.no_scrape:
+        scraper.SiteScraper.PREFETCH_DEPTH = args.prefetch
+        scraper.SiteScraper.BULK_INSERT = args.bulk_insert
 
-                pending_map[item.scraper_type][cls.__name__] += 1
+        scraper.SiteScraper.RATE_LIMIT = \
+            ratelimit.RateLimiter(args.scrape_rate, args.scrape_burst)
 
-        print json.dumps(pending_map, sort_keys=True, indent=4)
+        if not args.no_http_cache:
+            scraper.SiteScraper.HTTP_CACHE = \
+                httpcache.HttpCache(http_cache_path)
 
-        sys.exit()
+        scraper.SiteScraper.configure_http(
+            pool_size=args.http_pool_size,
+            timeout=args.http_timeout,
+            headers={ 'User-Agent': args.user_agent }
+                    if args.user_agent else None)
 
-    if not args.no_scrape:
         with open(args.scrapers) as f:
             scrapers = map(lambda s: s.strip(), list(f))
 
         if args.only:
             scrapers = args.only.split(',')
 
-        for s in scrapers:
+        # Python-style comments available for scrapers.txt
+        scrapers = [ s for s in scrapers
+                     if not s.startswith('#') and not len(s) == 0 ]
+
+        with profiler.phase('scrape'):
+            timers = run_scrapers(scrapers, args.scrape_workers,
+                                  args.scrape_async)
 
-            # Python-style comments available for scrapers.txt
-            if not s.startswith('#') and not len(s) == 0:
-                getattr(scraper, s)().scrape()
+        logger.info('Stage timings (seconds):\n%s' %
+                    timing.summary_table(timers))
+
+        if args.timing_report:
+            with open(args.timing_report, 'w') as f:
+                json.dump(timing.run_report(timers), f, indent=4,
+                          sort_keys=True)
     else:
         logger.info('Skipping scrape')
 
@@ -135,7 +392,15 @@ if __name__ == '__main__':
             logger.info('Post limit: %d' % args.post_limit)
 
         try:
-            d = uploader.DrupalPoster()
+            retry = uploader.RetryPolicy(max_tries=args.post_max_tries,
+                                         max_delay=args.post_max_delay,
+                                         budget=args.post_retry_budget)
+
+            rate_limit = ratelimit.RateLimiter(args.post_rate,
+                                               args.post_burst)
+
+            d = uploader.DrupalPoster(pool_size=args.post_workers,
+                                      retry=retry, rate_limit=rate_limit)
         except Exception, e:
             logger.error(e)
             logger.error('Login error, exiting')
@@ -149,13 +414,9 @@ if __name__ == '__main__':
         if args.pubs_only:
             classes = [ Publication ]
 
-        for cls in classes:
-            things = cls.pending_post()            
-
-            if len(things) == 0:
-                logger.warning('No pending items for %s' % cls.__name__)
-            else:
-                do_post(d, things, args.post_limit)
+        with profiler.phase('post'):
+            for cls in classes:
+                do_post(d, cls, args.post_limit, args.post_workers)
 
     else:
         logger.info('Skipping post')
@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+
+import requests
+
+# Persistent ETag/Last-Modified cache for conditional GETs, kept in a small
+# sidecar SQLite file so scraper threads can use it without the ORM session
+class HttpCache:
+    def __init__(self, path):
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.text_factory = str
+
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                encoding TEXT,
+                body BLOB
+            )""")
+        self.__db.commit()
+
+    # Validators to send with a request for url
+    def headers(self, url):
+        with self.__lock:
+            row = self.__db.execute(
+                'SELECT etag, last_modified FROM responses WHERE url = ?',
+                (url,)).fetchone()
+
+        headers = {}
+
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+
+        return headers
+
+    # Fill in a 304 response with the body stored for its URL. Status stays
+    # 304 so callers can tell the resource is unchanged.
+    def fill(self, url, r):
+        with self.__lock:
+            row = self.__db.execute(
+                'SELECT content_type, encoding, body FROM responses '
+                'WHERE url = ?', (url,)).fetchone()
+
+        if row is None:
+            return False
+
+        r.headers['content-type'] = row[0] or ''
+        r.encoding = row[1]
+        r._content = str(row[2] or '')
+
+        return True
+
+    # Record responses that carry validators, called once a scrape succeeds
+    def store(self, responses):
+        rows = []
+
+        for url, r in responses:
+            etag = r.headers.get('etag')
+            last_modified = r.headers.get('last-modified')
+
+            if r.status_code != requests.codes.ok or \
+               not (etag or last_modified):
+                continue
+
+            rows.append((url, etag, last_modified,
+                         r.headers.get('content-type'), r.encoding,
+                         sqlite3.Binary(r.content)))
+
+        with self.__lock:
+            self.__db.executemany(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+            self.__db.commit()
+
+        return len(rows)
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
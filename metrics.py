@@ -0,0 +1,185 @@
+import os
+import socket
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'aggregator_'
+
+# Exported metrics: name -> (type, help)
+METRICS = {
+    'items_scraped_total':
+        ('counter', 'New items saved, by scraper'),
+    'items_duplicate_total':
+        ('counter', 'Items skipped as already stored, by scraper'),
+    'items_date_limited_total':
+        ('counter', 'Items past the scraper start date, by scraper'),
+    'pages_fetched_total':
+        ('counter', 'Listing pages and feeds downloaded, by scraper'),
+    'bytes_downloaded_total':
+        ('counter', 'Response body bytes downloaded, by scraper'),
+    'http_request_seconds':
+        ('histogram', 'HTTP request latency, by target (source or drupal)'),
+    'posts_total':
+        ('counter', 'Drupal posts, by content type and result'),
+    'post_retries_total':
+        ('counter', 'Drupal requests retried'),
+    'run_duration_seconds':
+        ('gauge', 'Duration of the last run'),
+    'last_run_timestamp_seconds':
+        ('gauge', 'Unix time the last run finished')
+}
+
+BUCKETS = [ 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60 ]
+
+# Sends each update as a StatsD UDP packet, labels are folded into the
+# metric path. Sending never raises, metrics are best effort.
+class StatsdEmitter:
+    def __init__(self, host, port=8125, prefix='aggregator'):
+        self.address = (host, int(port))
+        self.prefix = prefix
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __path(self, name, labels):
+        parts = [ self.prefix, name ] + \
+                [ str(labels[k]).replace('.', '_') for k in sorted(labels) ]
+
+        return '.'.join(parts)
+
+    def emit(self, kind, name, value, labels):
+        suffix = { 'counter': 'c', 'gauge': 'g', 'histogram': 'ms' }[kind]
+
+        if kind == 'histogram':
+            value = value * 1000
+
+        try:
+            self.__sock.sendto('%s:%g|%s' % (self.__path(name, labels),
+                                             value, suffix), self.address)
+        except socket.error, e:
+            logger.debug('StatsD send failed (%s)' % e)
+
+# Counters, gauges and histograms for one run, exported in the Prometheus
+# text format and optionally mirrored to StatsD as they change
+class Registry:
+    def __init__(self):
+        self.emitter = None
+
+        self.__values = {}
+        self.__histograms = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + value
+
+        self.__emit('counter', name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.__lock:
+            self.__values[key] = value
+
+        self.__emit('gauge', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.__lock:
+            if key not in self.__histograms:
+                self.__histograms[key] = [ [ 0 ] * len(BUCKETS), 0.0, 0 ]
+
+            counts, total, count = self.__histograms[key]
+
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+
+            self.__histograms[key][1:] = [ total + value, count + 1 ]
+
+        self.__emit('histogram', name, value, labels)
+
+    def __emit(self, kind, name, value, labels):
+        if self.emitter is not None:
+            self.emitter.emit(kind, name, value, labels)
+
+    def text(self):
+        with self.__lock:
+            values = dict(self.__values)
+            histograms = dict((key, (list(h[0]), h[1], h[2]))
+                              for key, h in self.__histograms.items())
+
+        lines = []
+
+        for name in sorted(METRICS):
+            kind, help_text = METRICS[name]
+            full_name = PREFIX + name
+
+            if kind == 'histogram':
+                series = sorted(k for k in histograms if k[0] == name)
+            else:
+                series = sorted(k for k in values if k[0] == name)
+
+            if not series:
+                continue
+
+            lines.append('# HELP %s %s' % (full_name, help_text))
+            lines.append('# TYPE %s %s' % (full_name, kind))
+
+            for key in series:
+                labels = key[1]
+
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (full_name, format_labels(labels),
+                                              format_value(values[key])))
+                    continue
+
+                counts, total, count = histograms[key]
+
+                for bound, n in zip(BUCKETS, counts):
+                    lines.append('%s_bucket%s %d' % (
+                        full_name,
+                        format_labels(labels + (('le', format_value(bound)),)),
+                        n))
+
+                lines.append('%s_bucket%s %d' % (
+                    full_name, format_labels(labels + (('le', '+Inf'),)),
+                    count))
+                lines.append('%s_sum%s %s' % (full_name, format_labels(labels),
+                                              format_value(total)))
+                lines.append('%s_count%s %d' % (full_name,
+                                                format_labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+    # Write via a temporary file and rename, so the node_exporter textfile
+    # collector never reads a half-written file
+    def write_textfile(self, path):
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+
+        with open(tmp, 'w') as f:
+            f.write(self.text())
+
+        os.rename(tmp, path)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Default registry the scrapers and poster report to
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+gauge = REGISTRY.gauge
+observe = REGISTRY.observe
@@ -1,29 +1,229 @@
 import sys
+import logging
+import datetime
+import threading
+import Queue
 
 sys.path.append('elixir')
 from elixir import *
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
 
 # metadata.bind.echo = True
 
+MODULE_LOG_LEVEL = logging.DEBUG
+
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter('[%(levelname)s] %(asctime)s %(message)s'))
+ch.setLevel(MODULE_LOG_LEVEL)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(MODULE_LOG_LEVEL)
+logger.addHandler(ch)
+
 def setup_elixir():
     setup_all()
     create_all()    
+    create_indexes()
+
+# Indexes are created with IF NOT EXISTS so older databases get them too
+def create_indexes():
+    for cls in [ Article, Event, Publication ]:
+        table = cls.table.name
+
+        # Duplicate check lookups by (scraper_type, url). Once it exists,
+        # any plain index from an earlier fallback is redundant.
+        try:
+            metadata.bind.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS ix_%s_scraper_url '
+                'ON %s (scraper_type, url)' % (table, table))
+            metadata.bind.execute(
+                'DROP INDEX IF EXISTS ix_%s_scraper_url_nonunique' % table)
+
+        # Databases already holding duplicates get a plain index instead,
+        # under its own name so the unique one is created once they're gone
+        except IntegrityError:
+            logger.warning('Duplicate (scraper_type, url) rows in %s, using '
+                           'a non-unique index' % table)
+
+            metadata.bind.execute(
+                'CREATE INDEX IF NOT EXISTS ix_%s_scraper_url_nonunique '
+                'ON %s (scraper_type, url)' % (table, table))
+
+        # Partial index over unposted rows only, so the pending queue stays
+        # cheap to walk however much has already been posted
+        metadata.bind.execute(
+            'CREATE INDEX IF NOT EXISTS ix_%s_pending '
+            'ON %s (id) WHERE time_posted IS NULL' % (table, table))
+
+        # Covers pending_summary()'s GROUP BY and date range, so it only
+        # reads the pending rows too
+        metadata.bind.execute(
+            'CREATE INDEX IF NOT EXISTS ix_%s_pending_summary '
+            'ON %s (scraper_type, %s) WHERE time_posted IS NULL' %
+            (table, table, ', '.join(cls.DATE_COLUMNS)))
+
+# PRAGMAs run on every new connection for each storage profile. 'fast'
+# trades a little durability on power loss (never corruption) for a WAL
+# journal and fewer fsyncs.
+SQLITE_PROFILES = {
+    'default': [],
+    'fast': [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA cache_size=-65536',
+        'PRAGMA mmap_size=268435456',
+        'PRAGMA temp_store=MEMORY'
+    ]
+}
+
+def change_db(db, profile='default'):
+    pragmas = SQLITE_PROFILES[profile]
+
+    if not pragmas:
+        metadata.bind = 'sqlite:///%s' % db
+        return
+
+    # Pool connections so the page cache and mmap outlive each transaction
+    engine = create_engine('sqlite:///%s' % db, poolclass=QueuePool,
+                           connect_args={ 'check_same_thread': False })
+
+    def set_pragmas(connection, record):
+        cursor = connection.cursor()
+
+        for pragma in pragmas:
+            cursor.execute(pragma)
+
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+    metadata.bind = engine
+
+# Runs every operation against the scoped session on a single thread, so
+# concurrent scrapers never touch the session (or SQLite) directly
+class SessionWriter(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__jobs = Queue.Queue()
+
+    # Run fn on the writer thread, block for its result and re-raise any
+    # exception (e.g. DuplicateException) in the calling thread
+    def call(self, fn, *args, **kwargs):
+        reply = Queue.Queue(1)
+        self.__jobs.put((fn, args, kwargs, reply))
+
+        ok, rv = reply.get()
+
+        if ok:
+            return rv
+
+        raise rv[0], rv[1], rv[2]
+
+    # Commit stragglers and shut the writer down once all callers are done
+    def stop(self):
+        self.__jobs.put(None)
+        self.join()
+
+    def run(self):
+        while 1:
+            job = self.__jobs.get()
+
+            if job is None:
+                break
 
-def change_db(db):
-    metadata.bind = 'sqlite:///%s' % db
+            fn, args, kwargs, reply = job
+
+            try:
+                reply.put((True, fn(*args, **kwargs)))
+            except:
+                reply.put((False, sys.exc_info()))
+
+        session.commit()
+        session.remove()
 
 class DrupalBase:
+    # Rows loaded per query when walking the pending queue
+    PENDING_CHUNK = 500
+
+    # Columns item_date() is made from
+    DATE_COLUMNS = [ 'date' ]
+
+    # Unposted rows in id order, loaded a chunk at a time. Each chunk starts
+    # after the last id seen, so rows posted (and committed) meanwhile don't
+    # shift the window the way an OFFSET would.
     @classmethod
-    def pending_post(cls):
-        return cls.query.filter_by(time_posted=None).all()
+    def pending_post(cls, chunk_size=None):
+        chunk_size = chunk_size or cls.PENDING_CHUNK
+        last_id = 0
+
+        while 1:
+            chunk = cls.query.filter(cls.time_posted == None) \
+                             .filter(cls.id > last_id) \
+                             .order_by(cls.id).limit(chunk_size).all()
+
+            if not chunk:
+                break
 
+            # Read before yielding, a commit expires the loaded rows
+            last_id = chunk[-1].id
+
+            for thing in chunk:
+                yield thing
+
+            if len(chunk) < chunk_size:
+                break
+
+    # When an item happened, for the date summaries and filters
     @classmethod
-    def set_all_pending(cls):
-        for thing in cls.query.all():
-            thing.time_posted = None
+    def item_date(cls):
+        return cls.date
 
+    @classmethod
+    def pending_count(cls):
+        return cls.query.filter(cls.time_posted == None).count()
+
+    # Pending counts per scraper_type, plus the oldest and newest item
+    # dates when with_dates is set, computed in SQL without loading rows
+    @classmethod
+    def pending_summary(cls, with_dates=False):
+        columns = [ cls.scraper_type, func.count(cls.id) ]
+
+        if with_dates:
+            columns += [ func.min(cls.item_date()),
+                         func.max(cls.item_date()) ]
+
+        return session.query(*columns) \
+                      .filter(cls.time_posted == None) \
+                      .group_by(cls.scraper_type) \
+                      .order_by(cls.scraper_type).all()
+
+    # Mark posted rows pending again with a single UPDATE, optionally only
+    # those from some scrapers or dated from since through the day of until.
+    # Returns the number of rows changed.
+    @classmethod
+    def set_all_pending(cls, scraper_types=None, since=None, until=None):
+        query = cls.query.filter(cls.time_posted != None)
+
+        if scraper_types:
+            query = query.filter(cls.scraper_type.in_(
+                [ unicode(t) for t in scraper_types ]))
+
+        if since:
+            query = query.filter(cls.item_date() >= since)
+
+        if until:
+            query = query.filter(
+                cls.item_date() < until + datetime.timedelta(days=1))
+
+        count = query.update({ 'time_posted': None },
+                             synchronize_session=False)
         session.commit()
 
+        return count
+
 class Article(DrupalBase, Entity):
     title = Field(Unicode)
     url = Field(Unicode)
@@ -43,6 +243,13 @@ class Event(DrupalBase, Entity):
     start_time = Field(DateTime)
     end_time = Field(DateTime)
     scraper_type = Field(Unicode)
+
+    DATE_COLUMNS = [ 'date', 'start_time' ]
+
+    # Event scrapers may only set start_time
+    @classmethod
+    def item_date(cls):
+        return func.coalesce(cls.date, cls.start_time)
     
 class Publication(DrupalBase, Entity):
     title = Field(Unicode)
@@ -0,0 +1,136 @@
+import os
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from StringIO import StringIO
+from contextlib import contextmanager
+
+# Sampling profiler, only needed for --profile sampling
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+MODULE_LOG_LEVEL = logging.DEBUG
+
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter('[%(levelname)s] %(asctime)s %(message)s'))
+ch.setLevel(MODULE_LOG_LEVEL)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(MODULE_LOG_LEVEL)
+logger.addHandler(ch)
+
+# Profiles named phases of a run (scrape, post) into separate files in
+# out_dir: <phase>-<time>.prof (pstats) or .html (pyinstrument), plus a .txt
+# summary of the top functions. With no mode, phases run unprofiled.
+class PhaseProfiler:
+    def __init__(self, mode=None, out_dir='profiles', top=25):
+        if mode == 'sampling' and pyinstrument is None:
+            logger.warning('pyinstrument not installed, using cProfile')
+            mode = 'cprofile'
+
+        self.mode = mode
+        self.out_dir = out_dir
+        self.top = top
+        self.stamp = time.strftime('%Y%m%d-%H%M%S')
+
+    def __path(self, phase, ext):
+        if not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        return os.path.join(self.out_dir,
+                            '%s-%s.%s' % (phase, self.stamp, ext))
+
+    @contextmanager
+    def phase(self, name):
+        if self.mode is None:
+            yield
+        elif self.mode == 'sampling':
+            with self.__sampling(name):
+                yield
+        else:
+            with self.__cprofile(name):
+                yield
+
+    # cProfile only sees the thread that enables it, so threads started
+    # during the phase (scrape workers, post pool) get a profiler each and
+    # the results are merged
+    @contextmanager
+    def __cprofile(self, name):
+        profiles = []
+
+        def start_thread(*args):
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            profile.enable()
+
+        main = cProfile.Profile()
+        threading.setprofile(start_thread)
+        main.enable()
+
+        try:
+            yield
+        finally:
+            main.disable()
+            threading.setprofile(None)
+
+            stats = pstats.Stats(main)
+
+            for profile in profiles:
+                profile.disable()
+                profile.create_stats()
+
+                if profile.stats:
+                    stats.add(profile)
+
+            path = self.__path(name, 'prof')
+            stats.dump_stats(path)
+
+            summary = StringIO()
+            stats.stream = summary
+            stats.sort_stats('tottime').print_stats(self.top)
+            stats.sort_stats('cumulative').print_stats(self.top)
+
+            self.__write_summary(name, path, summary.getvalue())
+            self.__log_hot(name, stats)
+
+    # pyinstrument samples the main thread's stack
+    @contextmanager
+    def __sampling(self, name):
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+
+        try:
+            yield
+        finally:
+            profiler.stop()
+
+            path = self.__path(name, 'html')
+
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+
+            self.__write_summary(name, path, profiler.output_text())
+
+    def __write_summary(self, name, path, text):
+        summary_path = self.__path(name, 'txt')
+
+        with open(summary_path, 'w') as f:
+            f.write(text)
+
+        logger.info('Profile for %s written to %s (summary in %s)' %
+                    (name, path, summary_path))
+
+    # Log the few functions with the most time of their own
+    def __log_hot(self, name, stats, count=5):
+        total = stats.total_tt or 1.0
+        hot = sorted(stats.stats.items(), key=lambda item: item[1][2],
+                     reverse=True)[:count]
+
+        for (filename, line, func), (cc, nc, tt, ct, callers) in hot:
+            logger.info('  %s: %5.1f%% %7.3fs %s:%d(%s)' %
+                        (name, tt / total * 100, tt,
+                         os.path.basename(filename), line, func))
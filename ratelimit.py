@@ -0,0 +1,59 @@
+import time
+import threading
+import urlparse
+
+# Token bucket allowing rate requests per second on average, with bursts of
+# up to burst requests. Callers reserve a token and sleep outside the lock
+# until it is due, so waiting threads are served in order.
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+
+        self.__tokens = self.burst
+        self.__updated = time.time()
+        self.__lock = threading.Lock()
+
+    # Block until a request may go ahead, returning the seconds waited
+    def acquire(self):
+        with self.__lock:
+            now = time.time()
+
+            self.__tokens = min(self.burst, self.__tokens +
+                                (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens -= 1
+
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+# Token buckets per host, shared by every thread using the limiter. Hosts
+# without their own (rate, burst) in hosts use the default; a rate of None
+# leaves them unthrottled.
+class RateLimiter:
+    def __init__(self, rate=None, burst=1, hosts=None):
+        self.rate = rate
+        self.burst = burst
+        self.hosts = dict(hosts or {})
+
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    def __bucket(self, host):
+        with self.__lock:
+            if host not in self.__buckets:
+                rate, burst = self.hosts.get(host, (self.rate, self.burst))
+                self.__buckets[host] = \
+                    TokenBucket(rate, burst) if rate else None
+
+            return self.__buckets[host]
+
+    # Wait for the URL's host to allow another request
+    def wait(self, url):
+        bucket = self.__bucket(urlparse.urlparse(url).netloc.lower())
+
+        return bucket.acquire() if bucket else 0.0
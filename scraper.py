@@ -1,16 +1,24 @@
 import sys
 import time
+import itertools
+import threading
+import Queue
 import datetime
 from pprint import pprint
+from contextlib import contextmanager
 import logging
 
 import feedparser
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import requests
+from requests.adapters import HTTPAdapter
 import re
-import dateutil.parser
 
 from model import *
+import dedupe
+import dateparse
+import timing
+import metrics
 
 logging.getLogger('requests').setLevel(logging.WARNING)
 
@@ -33,11 +41,149 @@ class ProcessingError(Exception):
 class DateLimitException(Exception):
     pass
 
+class NotModifiedException(Exception):
+    pass
+
+# Strainer that keeps only elements matching simple selectors ('tag', '.class',
+# '#id' or 'tag.class') along with everything inside them
+def region_strainer(selectors):
+    regions = [ re.match(r'^([\w-]*)(?:([.#])([\w-]+))?$', sel).groups()
+                for sel in selectors ]
+
+    def match(name, attrs):
+        if not hasattr(attrs, 'get'):
+            attrs = dict(attrs)
+
+        for tag, kind, value in regions:
+            if tag and tag != name:
+                continue
+
+            if kind == '#' and attrs.get('id') != value:
+                continue
+
+            if kind == '.':
+                classes = attrs.get('class') or []
+
+                if isinstance(classes, basestring):
+                    classes = classes.split()
+
+                if value not in classes:
+                    continue
+
+            return True
+
+        return False
+
+    return SoupStrainer(match)
+
 # Generic scraper class
 class SiteScraper:
     RSS = False
     START_DATE = datetime.datetime(2014, 1, 1)
 
+    # BeautifulSoup tree builder: lxml, html.parser or html5lib
+    PARSER = 'lxml'
+    FALLBACK_PARSER = 'html.parser'
+
+    # Page regions (items and pagination) to parse, None for the whole page
+    PARSE_ONLY = None
+
+    # strptime formats tried before falling back to dateutil
+    DATE_FORMATS = []
+    DATE_CACHE_SIZE = 1024
+
+    # Shared HTTP session settings (see configure_http())
+    POOL_CONNECTIONS = 16
+    POOL_MAXSIZE = 10
+    REQ_TIMEOUT = 60
+    HEADERS = { 'User-Agent': 'content-aggregator' }
+
+    # URLs per duplicate lookup query
+    DEDUPE_CHUNK = 500
+
+    # Rows fetched at a time while loading known URLs
+    SEEN_LOAD_CHUNK = 1000
+
+    # Known URL histories larger than this are held in a Bloom filter
+    SEEN_BLOOM_THRESHOLD = 200000
+    SEEN_ERROR_RATE = 0.001
+
+    # Optional httpcache.HttpCache for conditional GETs
+    HTTP_CACHE = None
+
+    # Optional ratelimit.RateLimiter shared by all scrapers
+    RATE_LIMIT = None
+
+    # Collect each page's new items and insert them with one executemany
+    # instead of through the ORM
+    BULK_INSERT = False
+
+    # Listing pages downloaded ahead of the one being saved (0 = off)
+    PREFETCH_DEPTH = 0
+
+    __http = None
+    __http_lock = threading.Lock()
+
+    # Override pool size, timeout or default headers for all scrapers
+    @classmethod
+    def configure_http(cls, pool_size=None, timeout=None, headers=None):
+        with SiteScraper.__http_lock:
+            if pool_size is not None:
+                SiteScraper.POOL_MAXSIZE = pool_size
+
+            if timeout is not None:
+                SiteScraper.REQ_TIMEOUT = timeout
+
+            if headers is not None:
+                SiteScraper.HEADERS = dict(SiteScraper.HEADERS, **headers)
+
+            # Rebuilt with the new settings on next use
+            SiteScraper.__http = None
+
+    # Keep-alive session shared by every scraper, pooled per host
+    @classmethod
+    def http(cls):
+        with SiteScraper.__http_lock:
+            if SiteScraper.__http is None:
+                adapter = HTTPAdapter(
+                    pool_connections=SiteScraper.POOL_CONNECTIONS,
+                    pool_maxsize=SiteScraper.POOL_MAXSIZE)
+
+                http = requests.Session()
+                http.mount('http://', adapter)
+                http.mount('https://', adapter)
+                http.headers.update(SiteScraper.HEADERS)
+
+                SiteScraper.__http = http
+
+            return SiteScraper.__http
+
+    # Optional SessionWriter; set when scrapers run concurrently
+    def __init__(self, writer=None):
+        self.__writer = writer
+        self.__seen = None
+        self.__fetched = []
+        self.__rows = []
+        self.__dates = dateparse.DateParser(self.DATE_FORMATS,
+                                            self.DATE_CACHE_SIZE)
+        self.__strainer = region_strainer(self.PARSE_ONLY) \
+                          if self.PARSE_ONLY else None
+
+        # Stage timings. Pages (or feeds) are numbered as they are fetched
+        # and again as they are saved, which happens in the same order.
+        self.timer = timing.StageTimer(self.__class__.__name__)
+        self.__fetch_count = 0
+        self.__save_count = 0
+        self.__save_page = None
+        self.__new_items = 0
+
+    # Run a database operation, via the session writer if there is one
+    def _db(self, fn, *args):
+        if self.__writer is None:
+            return fn(*args)
+
+        return self.__writer.call(fn, *args)
+
     # Base implementation always returns None
     def _next_link(self, soup):
         return None
@@ -46,121 +192,480 @@ class SiteScraper:
     def get(self, url=None):
         if self.RSS:
 
-            # Allow multiple feeds to be aggregated
+            # Allow multiple feeds to be aggregated, later feeds are only
+            # fetched once the earlier ones' entries have been consumed
             if type(self.URL) == list:
-                return [ feedparser.parse(url)['entries'] for url in self.URL ]
+                return itertools.chain.from_iterable(
+                    self._get_feed(url) for url in self.URL)
             else:
-                return feedparser.parse(self.URL)['entries']
+                return self._get_feed(self.URL)
+        else:
+            first = url is None
+            url = self.URL if first else url
+
+            self.__fetch_count += 1
+            page = self.__fetch_count
+
+            with self.timer.stage('fetch', page):
+                r = self.fetch(url)
+
+            # Unchanged first page, nothing new to scrape
+            if first and r.status_code == requests.codes.not_modified:
+                raise NotModifiedException(url)
+
+            with self.timer.stage('parse', page):
+                return self._parse(r.text)
+
+    # Build the tree with this scraper's parser, falling back to the pure
+    # Python one if it isn't installed. Only PARSE_ONLY regions are kept.
+    def _parse(self, markup):
+        try:
+            return BeautifulSoup(markup, self.PARSER,
+                                 parse_only=self.__strainer)
+        except FeatureNotFound:
+            logger.warning('Parser %s not available for %s, using %s' %
+                           (self.PARSER, self.__class__.__name__,
+                            self.FALLBACK_PARSER))
+
+            return BeautifulSoup(markup, self.FALLBACK_PARSER,
+                                 parse_only=self.__strainer)
+
+    # All page and feed downloads go through the shared session. With an
+    # HTTP cache, a 304 comes back with the stored body filled in.
+    def fetch(self, url):
+        if self.HTTP_CACHE is None:
+            return self.__get(url)
+
+        r = self.__get(url, self.HTTP_CACHE.headers(url))
+
+        if r.status_code == requests.codes.not_modified:
+            if not self.HTTP_CACHE.fill(url, r):
+
+                # Validators without a body, fetch it again in full
+                return self.__get(url)
         else:
-            url = self.URL if url is None else url
-            return BeautifulSoup(requests.get(url).text)
+            self.__fetched.append((url, r))
+
+        return r
+
+    # GET through the shared session, waiting for the rate limit first
+    def __get(self, url, headers=None):
+        if self.RATE_LIMIT is not None:
+            self.RATE_LIMIT.wait(url)
+
+        start = time.time()
+        r = self.http().get(url, timeout=self.REQ_TIMEOUT, headers=headers)
+
+        metrics.observe('http_request_seconds', time.time() - start,
+                        target='source')
+        metrics.inc('pages_fetched_total', scraper=self.__class__.__name__)
+        metrics.inc('bytes_downloaded_total', len(r.content),
+                    scraper=self.__class__.__name__)
+
+        return r
+
+    # Cache validators only once a scrape has succeeded and its items are
+    # committed, so a failed run doesn't hide pages (with a 304) on the next
+    def _store_http_cache(self):
+        if self.HTTP_CACHE is not None and self.__fetched:
+            self.HTTP_CACHE.store(self.__fetched)
+
+        self.__fetched = []
+
+    # Fetch and parse one feed. Body is already decoded by requests, so only
+    # pass on the content type.
+    def _get_feed(self, url):
+        self.__fetch_count += 1
+        feed = self.__fetch_count
+
+        # Entries are consumed in feed order, so everything done from here on
+        # is charged to this feed
+        self.__save_page = feed
+
+        with self.timer.stage('fetch', feed):
+            r = self.fetch(url)
+
+        # Unchanged feeds aren't parsed at all
+        if r.status_code == requests.codes.not_modified:
+            logger.debug('Feed unchanged (%s)' % url)
+            return []
+
+        with self.timer.stage('parse', feed):
+            return feedparser.parse(r.content, response_headers={
+                'content-type': r.headers.get('content-type', ''),
+                'content-location': r.url
+            })['entries']
 
     # Convert a string or time struct into a datetime
     def get_date(self, date):
-        if type(date) in (str, unicode):
-            return dateutil.parser.parse(date)
-        else:
-            return datetime.datetime.fromtimestamp(time.mktime(date))
+        with self.timer.stage('date', self.__save_page):
+            if type(date) in (str, unicode):
+                return self.__dates.parse(date)
+            else:
+                return datetime.datetime.fromtimestamp(time.mktime(date))
 
     # Base scrape method for RSS and regular sites
     def scrape(self):
+        with self._scraping():
+            if self.RSS:
+                self._save_feed(self.get())
+            else:
+                pages = self._pages()
+
+                # Process pages until there are no more, closing the page
+                # generator cancels any prefetches still in flight
+                try:
+                    for soup in pages:
+                        new_items, done = self._save_page(soup)
+
+                        if done:
+                            break
+                finally:
+                    pages.close()
+
+    # Everything around a scrape's page or feed loop (logging, timing,
+    # errors, the final commit and cache validators), shared with the event
+    # loop version in aioscrape
+    @contextmanager
+    def _scraping(self):
         logger.info('Starting scrape for %s' % self.__class__.__name__)
 
+        self.__new_items = 0
+        completed = False
+        self.timer.start()
+
+        try:
+            yield
+
+            logger.info('Scrape complete for %s (%d new items)' %
+                        (self.__class__.__name__, self.__new_items))
+
+            completed = True
+
+        except NotModifiedException, e:
+            logger.info('%s unchanged since last scrape (%s)' %
+                        (self.__class__.__name__, e))
+
+        # Log any uncaught exceptions (network errors)
+        except Exception, e:
+            logger.error('Uncaught error in %s (network error?)' % 
+                         self.__class__.__name__)
+            logger.exception(e)
+
+        self._log_date_stats()
+
+        # Commit any stragglers (?)
+        committed = self._finish_commit()
+
+        if completed and committed:
+            self._store_http_cache()
+
+        self.timer.finish()
+
+    # Cache hits and dateutil fallbacks, to spot slow date sources
+    def _log_date_stats(self):
+        stats = self.__dates.stats()
+
+        if stats['lookups']:
+            logger.info('Dates for %s: %d parsed, %.0f%% cached, '
+                        '%d strptime, %d dateutil' %
+                        (self.__class__.__name__, stats['lookups'],
+                         stats['hit_rate'] * 100, stats['strptime'],
+                         stats['fallbacks']))
+
+    # Save feed entries until a duplicate or the date limit. Entries flow
+    # through _scrape_rss() and the duplicate check one at a time, so
+    # stopping early skips the rest of the work. Returns the number of new
+    # items and whether it stopped early.
+    def _save_feed(self, entries):
         num_items = 0
+        done = False
+        entries = self._scrape_rss(entries)
+
+        while 1:
+
+            # Feeds are downloaded and parsed lazily, as entries are needed,
+            # so the feed an entry came from is only known afterwards
+            with self.timer.stage('extract', lambda: self.__save_page):
+                params = next(entries, None)
+
+            if params is None:
+                break
+
+            try:
+                self._db(self.__save_one, params)
+                num_items += 1
+
+            except DuplicateException, e:
+                logger.warning(
+                    'Found duplicate item (%s)' % e)
+
+                done = True
+                break
+
+            # Abort feed scrape if start date passed
+            except DateLimitException, e:
+                logger.warning(
+                    'Date limit passed (%s)' % e)
+
+                done = True
+                break
+
+        self.__new_items += num_items
 
+        return num_items, done
+
+    # Next page link, None when there are no more pages
+    def _page_link(self, soup):
+
+        # If _next_link() barfs, scrape is over
         try:
-            if self.RSS:
-                for params in self._scrape_rss(self.get()):
-                    try:
-                        self.__save(params)
-                        num_items += 1
+            return self._next_link(soup)
+        except:
+            return None
 
-                    except DuplicateException, e:
-                        logger.warning(
-                            'Found duplicate item (%s)' % e)
-                        break
+    # Parsed listing pages, fetched one after the other or with prefetching
+    def _pages(self):
+        if self.PREFETCH_DEPTH > 0:
+            return self.__prefetch_pages()
 
-                    # Abort feed scrape if start date passed
-                    except DateLimitException, e:
-                        logger.warning(
-                            'Date limit passed (%s)' % e)
-                        break
+        return self.__fetch_pages()
 
-                logger.info('Scrape complete for %s (%d new items)' %
-                            (self.__class__.__name__, num_items))
-            else:
-                page = 1
-                link = None
+    def __fetch_pages(self):
+        page = 1
+        link = None
 
-                logger.debug('%d %s' % (page, self.URL))
+        logger.debug('%d %s' % (page, self.URL))
 
-                # Process pages until there are no more
-                while 1:
-                    soup = self.get(link)
+        while 1:
+            soup = self.get(link)
+            link = self._page_link(soup)
 
-                    # If _next_link() barfs, scrape is over
-                    try:
-                        link = self._next_link(soup)
-                    except:
-                        link = None
-
-                    for item in self._get_items(soup):
-                        try:
-                            params = self._process_item(item)
-
-                        # Catch all processing errors, skip item
-                        except Exception, e:
-                            logger.error('Processing error, skipping item')
-                            logger.exception(e)
-                            continue
-
-                        try:
-                            self.__save(params)
-                            num_items += 1
-
-                        # Don't abort on dupe as pagination could be wonky
-                        except DuplicateException, e:
-                            logger.warning(
-                                'Found duplicate item (%s)' % e)
-                            break
+            yield soup
 
-                        except DateLimitException, e:
-                            logger.warning(
-                                'Date limit passed (%s)' % e)
+            # When next page link is None, scrape's complete
+            if link is None:
+                return
 
-                            link = None
-                            break
+            page += 1
+            logger.debug('%d %s' % (page, link))
+
+    # Download and parse up to PREFETCH_DEPTH pages on a background thread
+    # while the caller saves the current one
+    def __prefetch_pages(self):
+        pages = Queue.Queue()
+        slots = Queue.Queue()
+        cancelled = threading.Event()
+
+        for i in range(self.PREFETCH_DEPTH):
+            slots.put(None)
+
+        def fetch():
+            page = 1
+            link = None
+
+            try:
+                while not cancelled.is_set():
+
+                    # Wait for a free slot, giving up if cancelled
+                    try:
+                        slots.get(timeout=0.5)
+                    except Queue.Empty:
+                        continue
+
+                    logger.debug('%d %s' % (page, link or self.URL))
 
-                    # Commit after each page is processed
-                    session.commit()
+                    soup = self.get(link)
+                    link = self._page_link(soup)
+                    pages.put((soup, None))
 
-                    # When next page link is None, scrape's complete
                     if link is None:
-                        logger.info('Scrape complete for %s (%d new items)' %
-                                    (self.__class__.__name__, num_items))
                         break
-                        
-                    else:
-                        page += 1
-                        logger.debug('%d %s' % (page, link))
 
-        # Log any uncaught exceptions (network errors)
+                    page += 1
+
+            except:
+                pages.put((None, sys.exc_info()))
+
+            pages.put((None, None))
+
+        fetcher = threading.Thread(target=fetch)
+        fetcher.daemon = True
+        fetcher.start()
+
+        try:
+            while 1:
+                soup, exc_info = pages.get()
+
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+                if soup is None:
+                    return
+
+                slots.put(None)
+
+                yield soup
+
+        # Stop fetching on early exit (date limit, errors)
+        finally:
+            cancelled.set()
+
+    # Save the items on a listing page, returns the number of new items and
+    # whether the date limit was reached
+    def _save_page(self, soup):
+        num_items = 0
+        done = False
+        items = []
+
+        self.__save_count += 1
+        page = self.__save_page = self.__save_count
+
+        with self.timer.stage('extract', page):
+            for item in self._get_items(soup):
+                try:
+                    items.append(self._process_item(item))
+
+                # Catch all processing errors, skip item
+                except Exception, e:
+                    logger.error('Processing error, skipping item')
+                    logger.exception(e)
+
+        # One duplicate lookup for the whole page
+        known = self._db(self.__known_urls, items)
+
+        for params in items:
+            try:
+                self._db(self.__save, params, known)
+                num_items += 1
+
+            # Don't abort on dupe as pagination could be wonky
+            except DuplicateException, e:
+                logger.warning(
+                    'Found duplicate item (%s)' % e)
+                break
+
+            except DateLimitException, e:
+                logger.warning(
+                    'Date limit passed (%s)' % e)
+
+                done = True
+                break
+
+        # Commit after each page is processed
+        self._db(self._commit)
+
+        self.__new_items += num_items
+
+        return num_items, done
+
+    # Commit the session, writing any rows collected in bulk mode first. On
+    # failure the session is rolled back and the rows dropped.
+    def _commit(self):
+        with self.timer.stage('commit', self.__save_page):
+            try:
+                if self.__rows:
+                    session.execute(self.CLS.table.insert(), self.__rows)
+
+                session.commit()
+            except:
+                session.rollback()
+                raise
+            finally:
+                self.__rows = []
+
+    # Final commit of a scrape, errors are logged rather than raised so one
+    # scraper can't stop the others. Returns whether it succeeded.
+    def _finish_commit(self):
+        try:
+            self._db(self._commit)
+            return True
+
         except Exception, e:
-            logger.error('Uncaught error in %s (network error?)' % 
-                         self.__class__.__name__)
+            logger.error('Commit failed for %s' % self.__class__.__name__)
             logger.exception(e)
+            return False
+
+    # Load every stored URL for this scraper in one query, so duplicate
+    # checks don't need the database. Rows are streamed in chunks, the whole
+    # history is never held in memory at once.
+    def __load_seen(self):
+        name = self.__class__.__name__
+        where = [ self.CLS.scraper_type == unicode(name),
+                  self.CLS.url != None ]
+
+        # Plain COUNT(*), answered from the (scraper_type, url) index
+        count = session.query(func.count()).select_from(self.CLS.table) \
+                       .filter(*where).scalar()
+
+        if count > self.SEEN_BLOOM_THRESHOLD:
+            seen = dedupe.BloomFilter(count * 2, self.SEEN_ERROR_RATE)
+        else:
+            seen = dedupe.UrlSet()
 
-        # Commit any stragglers (?)
-        session.commit()
+        query = session.query(self.CLS.url).filter(*where) \
+                       .yield_per(self.SEEN_LOAD_CHUNK)
+
+        for url, in query:
+            seen.add(url)
+
+        logger.info('Loaded %d known URLs for %s (%s, %.1f KiB)' %
+                    (count, name, seen.__class__.__name__,
+                     seen.memory() / 1024.0))
+
+        return seen
+
+    # URLs out of a batch of items that are already stored for this scraper
+    def __known_urls(self, items):
+        with self.timer.stage('dedupe', self.__save_page):
+            return self.__find_known(items)
+
+    def __find_known(self, items):
+        if self.__seen is None:
+            self.__seen = self.__load_seen()
 
-    def __save(self, params):
+        urls = [ url for url in set(params['url'] for params in items)
+                 if url in self.__seen ]
 
+        if self.__seen.exact or len(urls) == 0:
+            return set(urls)
+
+        # Bloom filter hits may be false positives, confirm them
+        known = set()
+
+        # Stay under SQLite's bound parameter limit
+        for i in range(0, len(urls), self.DEDUPE_CHUNK):
+            query = session.query(self.CLS.url).filter(
+                self.CLS.scraper_type == unicode(self.__class__.__name__),
+                self.CLS.url.in_(urls[i:i + self.DEDUPE_CHUNK]))
+
+            known.update(url for url, in query)
+
+        # Rows held back for a bulk insert aren't in the table yet
+        if self.__rows:
+            pending = set(row['url'] for row in self.__rows)
+            known.update(url for url in urls if url in pending)
+
+        return known
+
+    def __save_one(self, params):
+        self.__save(params, self.__known_urls([ params ]))
+
+    # Save an item unless its URL is in known, which is updated as items are
+    # added so repeats within a batch are caught too
+    def __save(self, params, known):
+        with self.timer.stage('save', self.__save_page):
+            self.__add(params, known)
+
+    def __add(self, params, known):
         if self.CLS in (Article, Publication):
             if 'date' not in params:
                 logger.error('Date missing from %s' % params['url'])
                 return
 
             if params['date'] <= self.START_DATE:
+                metrics.inc('items_date_limited_total',
+                            scraper=self.__class__.__name__)
                 raise DateLimitException(params['date'])
 
         params['time_scraped'] = datetime.datetime.now()
@@ -169,19 +674,29 @@ class SiteScraper:
         # Always convert body to unicode
         params['body'] = unicode(params['body'])
 
-        query = self.CLS.query.filter_by(
-                url=params['url'], 
-                scraper_type=params['scraper_type'])
+        if params['url'] in known:
+            metrics.inc('items_duplicate_total',
+                        scraper=self.__class__.__name__)
+            raise DuplicateException(params['url'])
 
-        if query.count() == 0:
-            self.CLS(**params)
+        if self.BULK_INSERT:
+            self.__rows.append(dict((c.name, params.get(c.name))
+                                    for c in self.CLS.table.columns
+                                    if c.name != 'id'))
         else:
-            raise DuplicateException(params['url'])
+            self.CLS(**params)
+
+        known.add(params['url'])
+        self.__seen.add(params['url'])
+
+        metrics.inc('items_scraped_total', scraper=self.__class__.__name__)
 
 class WBSouthAsia(SiteScraper):
     URL = 'http://www.worldbank.org/en/region/sar/whats-new'
     URL_BASE = 'http://www.worldbank.org'
     CLS = Article
+    DATE_FORMATS = [ '%B %d, %Y' ]
+    PARSE_ONLY = [ 'div.n07v3-generic-list-comp', 'div.f05v3-pagination' ]
 
     def _next_link(self, soup):
         rv = None
@@ -231,22 +746,20 @@ class AsianDevelopmentBank(SiteScraper):
     CLS = Article
 
     def _scrape_rss(self, items):
-        rv = []
-
         for article in items:
-            rv.append({
+            yield {
                 'title': article['title'],
                 'url': article['feedburner_origlink'],
                 'body': article['summary'],
                 'date': self.get_date(article['published'])
-            })
-
-        return rv
+            }
 
 class ASEAN(SiteScraper):
     URL = 'http://www.asean.org/news'
     URL_BASE = 'http://www.asean.org'
     CLS = Article
+    PARSE_ONLY = [ 'div.teaser-item', 'div.pagination-bg' ]
+    DATE_FORMATS = [ '%d %B %Y' ]
 
     def _next_link(self, soup):
         return self.URL_BASE + soup.select(
@@ -275,6 +788,8 @@ class UNESCAP(SiteScraper):
     URL = 'http://www.unescap.org/media-centre/feature-stories'
     URL_BASE = 'http://www.unescap.org'
     CLS = Article
+    PARSE_ONLY = [ 'div.view-mode-feature_story', 'li.pager-next' ]
+    DATE_FORMATS = [ '%d %b %Y', '%d %B %Y' ]
 
     def _next_link(self, soup):
         return self.URL_BASE + soup.select('li.pager-next a')[0]['href']
@@ -296,10 +811,13 @@ class UNESCAP(SiteScraper):
             'date': date
         }
 
+# Sibling-walking scrapers are pinned to the parser they were written against
 class CACAARI(SiteScraper):
     URL = 'http://www.cacaari.org/en.php?/news'
     URL_BASE = 'http://www.cacaari.org'
     CLS = Article
+    PARSER = 'html.parser'
+    PARSE_ONLY = [ '#page_body', '#pages_counter' ]
 
     def _next_link(self, soup):
         for a in soup.select('#pages_counter a'):
@@ -340,6 +858,9 @@ class UCentralAsiaNewsScraper(SiteScraper):
     URL = 'http://www.ucentralasia.org/news.asp'
     URL_BASE = 'http://www.ucentralasia.org'
     CLS = Article
+    PARSER = 'html.parser'
+    PARSE_ONLY = [ '#centre' ]
+    DATE_FORMATS = [ '%d %B %Y' ]
 
     def _get_items(self, soup):
         rv = []
@@ -376,23 +897,21 @@ class APARRIEventScraper(SiteScraper):
     START_DATE = datetime.datetime(2010, 1, 1)
 
     def _scrape_rss(self, items):
-        rv = []
-
         for item in items:
-            rv.append({
+            yield {
                 'title': item['title'],
                 'url': item['link'],
                 'date': self.get_date(item['published_parsed']),
                 'body': item['summary']
-            })
-
-        return rv
+            }
 
 class UNESCAPEventScraper(SiteScraper):
     URL = 'http://www.unescap.org/events/upcoming'
     URL_BASE = 'http://www.unescap.org'
     CLS = Event
     START_DATE = datetime.datetime(2010, 1, 1)
+    PARSE_ONLY = [ 'div.item-list', 'li.pager-next' ]
+    DATE_FORMATS = [ '%d %b %Y', '%d %B %Y' ]
 
     def _next_link(self, soup):
         return self.URL_BASE + soup.select(
@@ -457,23 +976,21 @@ class ADBPubScraper(SiteScraper):
     START_DATE = datetime.datetime(2010, 1, 1)
 
     def _scrape_rss(self, items):
-        rv = []
-
         for item in items:
-            rv.append({
+            yield {
                 'title': item['title'],
                 'url': item['link'],
                 'body': item['description'],
                 'date': self.get_date(item['published_parsed'])
-            })
-
-        return rv
+            }
 
 class UNESCAPPubScraper(SiteScraper):
     URL = 'http://www.unescap.org/publications'
     URL_BASE = 'http://www.unescap.org'
     CLS = Publication
     START_DATE = datetime.datetime(2010, 1, 1)
+    PARSE_ONLY = [ '.view-content', '.pager-next' ]
+    DATE_FORMATS = [ '%d %b %Y', '%d %B %Y' ]
 
     def _next_link(self, soup):
         return self.URL_BASE + soup.select(
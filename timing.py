@@ -0,0 +1,98 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Wall-clock time spent in each stage of a scrape, in total and per listing
+# page (or feed). Stages can nest, e.g. date parsing inside extraction; each
+# is charged only its own time, so the stages add up to the time measured.
+class StageTimer:
+    STAGES = [ 'fetch', 'parse', 'extract', 'date', 'dedupe', 'save',
+               'commit' ]
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.totals = dict((stage, 0.0) for stage in self.STAGES)
+        self.pages = {}
+
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    # Time a block as stage, charged to page when given. page can also be a
+    # function, called when the block ends, for blocks that move on to the
+    # next page (e.g. pulling an entry from a lazily fetched feed).
+    @contextmanager
+    def stage(self, stage, page=None):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+
+        stack = self.__local.stack
+        stack.append(0.0)
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            nested = stack.pop()
+
+            # Let an enclosing stage know to leave this time out
+            if stack:
+                stack[-1] += elapsed
+
+            self.add(stage, elapsed - nested,
+                     page() if callable(page) else page)
+
+    def add(self, stage, seconds, page=None):
+        with self.__lock:
+            self.totals[stage] += seconds
+
+            if page is not None:
+                if page not in self.pages:
+                    self.pages[page] = dict(
+                        (s, 0.0) for s in self.STAGES)
+
+                self.pages[page][stage] += seconds
+
+    def start(self):
+        self.started = time.time()
+        self.finished = None
+
+    def finish(self):
+        self.finished = time.time()
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def report(self):
+        return {
+            'elapsed': self.elapsed(),
+            'stages': dict(self.totals),
+            'pages': [ dict(self.pages[page], page=page)
+                       for page in sorted(self.pages) ]
+        }
+
+# Summary table of stage totals, one row per scraper
+def summary_table(timers):
+    header = [ 'scraper', 'elapsed' ] + StageTimer.STAGES + [ 'pages' ]
+    lines = [ header ]
+
+    for timer in sorted(timers, key=lambda t: t.name):
+        lines.append([ timer.name, '%.2f' % timer.elapsed() ] +
+                     [ '%.2f' % timer.totals[s] for s in StageTimer.STAGES ] +
+                     [ str(len(timer.pages)) ])
+
+    widths = [ max(len(line[i]) for line in lines)
+               for i in range(len(header)) ]
+
+    return '\n'.join(
+        '  '.join(v.ljust(w) if i == 0 else v.rjust(w)
+                  for i, (v, w) in enumerate(zip(line, widths)))
+        for line in lines)
+
+# Machine-readable run report for a list of timers
+def run_report(timers):
+    return {
+        'scrapers': dict((timer.name, timer.report()) for timer in timers)
+    }
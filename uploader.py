@@ -1,12 +1,17 @@
 import time
 import os
 import json
+import random
 import datetime
 import logging
+import threading
+from email.utils import parsedate_tz, mktime_tz
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from model import *
+import metrics
 
 logging.getLogger('requests').setLevel(logging.WARNING)
 
@@ -20,6 +25,71 @@ logger = logging.getLogger(__name__)
 logger.setLevel(MODULE_LOG_LEVEL)
 logger.addHandler(ch)
 
+# When and how long DrupalPoster waits before repeating a failed request.
+# Delays grow exponentially with jitter so concurrent workers don't retry in
+# step, a Retry-After header wins when the server sends one, and the budget
+# caps retries across the whole run (None for no cap).
+class RetryPolicy:
+    RETRY_STATUSES = [ 429, 500, 502, 503, 504 ]
+
+    def __init__(self, max_tries=10, base_delay=1.0, max_delay=60.0,
+                 budget=100):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+        self.__lock = threading.Lock()
+
+    # Whether a response (None after a connection error) is worth retrying
+    def retryable(self, r):
+        return r is None or r.status_code in self.RETRY_STATUSES
+
+    # Take one retry from the run's budget, False once it's used up
+    def spend(self):
+        with self.__lock:
+            if self.budget is None:
+                return True
+
+            if self.budget <= 0:
+                return False
+
+            self.budget -= 1
+
+            return True
+
+    # Seconds to wait before attempt number tries + 1, Retry-After is capped
+    # at max_delay so a server can't stall the run for an hour
+    def delay(self, tries, r=None):
+        retry_after = self.retry_after(r)
+
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        # Equal jitter: at least half the exponential step, at most all of it
+        step = min(self.max_delay, self.base_delay * 2 ** (tries - 1))
+
+        return step / 2 + random.uniform(0, step / 2)
+
+    # Retry-After in seconds, given either as a number or an HTTP date
+    def retry_after(self, r):
+        value = r.headers.get('retry-after') if r is not None else None
+
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        parsed = parsedate_tz(value)
+
+        if parsed is None:
+            return None
+
+        return max(0.0, mktime_tz(parsed) - time.time())
+
 class DrupalPoster:
     CONTENT_TYPE_MAP = {
         'article': 'blog_post',
@@ -36,10 +106,11 @@ class DrupalPoster:
     DATE_FMT = '%m/%d/%Y'
     PUB_TYPE = '608'
     REQ_TIMEOUT = 120
-    REQ_DELAY = 60
-    MAX_TRIES = 10
+    POOL_MAXSIZE = 10
 
-    def __init__(self):
+    def __init__(self, pool_size=None, retry=None, rate_limit=None):
+        self.__retry = retry or RetryPolicy()
+        self.__rate_limit = rate_limit
         self.__base = os.environ['DRUPAL_BASE']
         self.__api_path = os.environ['DRUPAL_API_PATH']
         self.__user = os.environ['DRUPAL_USER']
@@ -47,8 +118,15 @@ class DrupalPoster:
         self.__node_path = os.environ['DRUPAL_NODE_PATH']
         self.__login_path = os.environ['DRUPAL_LOGIN_PATH']
 
-        self.__headers = { 'content-type' : 'application/json' }
-        self.__cookies = {}
+        # Keep-alive connection pool to the Drupal host; the login cookie
+        # and CSRF token are stored on the session itself
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size or self.POOL_MAXSIZE)
+
+        self.__http = requests.Session()
+        self.__http.mount('http://', adapter)
+        self.__http.mount('https://', adapter)
+        self.__http.headers.update({ 'content-type' : 'application/json' })
 
         self.__visit_home()
         self.__login()
@@ -59,18 +137,26 @@ class DrupalPoster:
     def __request(self, path='', data={}, method='post'):
         tries = 0
 
-        # Retry POST request N times
         while 1:
+            r = None
+
             try:
+                if self.__rate_limit is not None:
+                    self.__rate_limit.wait(self.__base)
+
+                start = time.time()
+
                 if method == 'get':
-                    r = requests.get(self.__base, timeout=self.REQ_TIMEOUT)
+                    r = self.__http.get(self.__base,
+                                        timeout=self.REQ_TIMEOUT)
                 else:
-                    r = requests.post(self.__url(path), 
-                                      data=json.dumps(data), 
-                                      headers=self.__headers,
-                                      cookies=self.__cookies,
-                                      timeout=self.REQ_TIMEOUT
-                                  )
+                    r = self.__http.post(self.__url(path), 
+                                         data=json.dumps(data), 
+                                         timeout=self.REQ_TIMEOUT
+                                     )
+
+                metrics.observe('http_request_seconds', time.time() - start,
+                                target='drupal')
 
                 r.raise_for_status()
                 
@@ -83,25 +169,41 @@ class DrupalPoster:
                     logger.error('Invalid user/pass')
                     raise e
 
-                # Warn on content/server error
-                else:
+                # Warn on content errors, retry throttling/server errors
+                if not self.__retry.retryable(r):
                     logger.warning(e)
                     logger.debug(data)
                     return r
 
+                error = e
+
             # Retry on connection error
             except requests.exceptions.ConnectionError, e:
-                tries += 1
+                error = e
 
-                # Throw exception after max tries
-                if tries == self.MAX_TRIES:
+            tries += 1
+
+            if tries >= self.__retry.max_tries or not self.__retry.spend():
+                if tries >= self.__retry.max_tries:
                     logger.error('Max request attempts exceeded')
-                    raise e
+                else:
+                    logger.error('Retry budget for this run exhausted')
 
-                logger.warning('Connection error (%d/%d), retrying...' 
-                               % (tries, self.MAX_TRIES))
+                # Server errors leave the thing pending, a dead connection
+                # stops the run
+                if r is None:
+                    raise error
+
+                logger.debug(data)
+                return r
 
-                time.sleep(self.REQ_DELAY)        
+            delay = self.__retry.delay(tries, r)
+
+            logger.warning('%s (%d/%d), retrying in %.1fs...' 
+                           % (error, tries, self.__retry.max_tries, delay))
+
+            metrics.inc('post_retries_total')
+            time.sleep(delay)
 
     def __visit_home(self):
         logger.debug('Visting home page (%s)...' % self.__base)
@@ -115,8 +217,8 @@ class DrupalPoster:
 
         r = self.__request(self.__login_path, data)
 
-        self.__cookies = { r.json()['session_name']: r.json()['sessid'] }
-        self.__headers['x-csrf-token'] = r.json()['token']
+        self.__http.cookies.set(r.json()['session_name'], r.json()['sessid'])
+        self.__http.headers['x-csrf-token'] = r.json()['token']
 
     # Append original date and URL to body
     def __body(self, body, date, url):
@@ -128,7 +230,8 @@ class DrupalPoster:
             }] 
         }
 
-    def post(self, thing):
+    # Build the node/create payload for a thing
+    def node(self, thing):
         node_type = self.CONTENT_TYPE_MAP[thing.__class__.__name__.lower()]
 
         data = {
@@ -172,8 +275,23 @@ class DrupalPoster:
                     }]
                 }
 
+        return data
+
+    # Create a node, returning the time it was posted (None on failure).
+    # Doesn't touch the DB, so it's safe to call from worker threads.
+    def send(self, data):
         r = self.__request(self.__node_path, data)
 
         if r.status_code == requests.codes.ok:
-            thing.time_posted = datetime.datetime.now()
+            return datetime.datetime.now()
+
+        return None
+
+    def post(self, thing):
+        time_posted = self.send(self.node(thing))
+
+        if time_posted:
+            thing.time_posted = time_posted
             session.commit()
+
+        return time_posted is not None